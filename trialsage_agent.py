@@ -1,20 +1,45 @@
 import streamlit as st
-import google.generativeai as genai
-import pdfplumber
 import os
 import json
+import re
+import io
+import time
+import hashlib
+import tempfile
+import threading
+import concurrent.futures
+from operator import itemgetter
 
-# --- Configuration ---
-# Configure the Gemini API key
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+# orjson parses the Gemini JSON response ~2-3x faster than stdlib json;
+# fall back silently when it isn't installed. orjson accepts str input
+# directly, so the streamed response text needs no encode round-trip.
 try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# --- Configuration ---
+@st.cache_resource(show_spinner=False)
+def _genai():
+    """Imports and configures google.generativeai on first use.
+
+    Deferred to first use because the import drags in grpc/protobuf
+    (seconds of cold start) and Streamlit re-executes this whole file on
+    every widget interaction. Raises if the API key is missing; callers
+    surface that through their normal error paths.
+    """
+    import google.generativeai as genai
     api_key = os.getenv("GOOGLE_API_KEY")
     if not api_key:
-        st.error("GOOGLE_API_KEY environment variable not found. Please set it in your system environment.")
-        st.stop()
+        raise RuntimeError(
+            "GOOGLE_API_KEY environment variable not found. "
+            "Please set it in your system environment."
+        )
     genai.configure(api_key=api_key)
-except Exception as e:
-    st.error(f"Error configuring Gemini API: {e}")
-    st.stop()
+    return genai
 
 # System instruction for the AI agent
 SYSTEM_INSTRUCTION = """You are an expert AI assistant for analyzing clinical trial protocols. Your task is to extract key information from the provided text and return it as a structured JSON object.
@@ -42,378 +67,624 @@ Your output must be ONLY the valid JSON object. Do not include any other text, e
 
 # --- Helper Functions ---
 
+# Precompiled patterns for clean_pdf_artifacts (compiled once at import
+# instead of re-parsing on every call)
+_PPD_LINE_RE = re.compile(r'\bPPD\s*\n')      # PPD on its own line
+_PPD_DBL_RE = re.compile(r'\bPPD\s+PPD\s*')   # Multiple PPDs
+_PPD_ISOLATED_RE = re.compile(r'(\s)PPD(\s)')  # Isolated PPD with spaces
+_OT_TYPO_RE = re.compile(r'\b(\d+)\s+ot\s+(\d+)\b')  # "6 ot 2" → "6 to 2"
+_BLANK_LINES_RE = re.compile(r'\n\s*\n\s*\n')  # Multiple blank lines
+_MULTI_SPACE_RE = re.compile(r' {3,}')         # Multiple spaces
+
 def clean_pdf_artifacts(text):
     """Remove common PDF processing artifacts"""
-    import re
-    
-    # Remove standalone PPD artifacts (but keep legitimate PPD abbreviations)
-    text = re.sub(r'\bPPD\s*\n', '', text)  # PPD on its own line
-    text = re.sub(r'\bPPD\s+PPD\s*', '', text)  # Multiple PPDs
-    text = re.sub(r'(\s)PPD(\s)', r'\1\2', text)  # Isolated PPD with spaces
-    
-    # Fix some common number/letter patterns
-    text = re.sub(r'\b(\d+)\s+ot\s+(\d+)\b', r'\1 to \2', text)  # "6 ot 2" → "6 to 2"
-    
+    # Cheap substring probes gate each pattern family so clean uploads
+    # (plain text, well-formed PDFs) skip the regex machinery entirely
+    if 'PPD' in text:
+        # Remove standalone PPD artifacts (but keep legitimate PPD abbreviations)
+        text = _PPD_LINE_RE.sub('', text)
+        text = _PPD_DBL_RE.sub('', text)
+        text = _PPD_ISOLATED_RE.sub(r'\1\2', text)
+
+    # Fix some common number/letter patterns; the pattern allows any \s+
+    # separator ("3\not\n4"), so no cheap substring probe covers it
+    text = _OT_TYPO_RE.sub(r'\1 to \2', text)
+
     # Remove excessive whitespace
-    text = re.sub(r'\n\s*\n\s*\n', '\n\n', text)  # Multiple blank lines
-    text = re.sub(r' {3,}', '  ', text)  # Multiple spaces
-    
+    if '\n' in text:
+        text = _BLANK_LINES_RE.sub('\n\n', text)
+    if '   ' in text:
+        text = _MULTI_SPACE_RE.sub('  ', text)
+
     return text
 
+# Common reversed words patterns
+reversed_patterns = {
+    'tuohsaW': 'Washout',
+    'doireP': 'Period', 
+    'skeew': 'weeks',
+    'gnineercS': 'Screening',
+    'tisiV': 'Visit',
+    'gniwollof': 'following',
+    'gnineercs': 'screening',
+    'tnesnoC': 'Consent',
+    'demrofnI': 'Informed',
+    'gnitseT': 'Testing',
+    'ycnangerP': 'Pregnancy',
+    'kcehC': 'Check',
+    'airetirC': 'Criteria',
+    'ytilibigilE': 'Eligibility',
+    'tneitap': 'patient',
+    'syaD': 'Days',
+    'motpmys': 'symptom',
+    'gnitroper': 'reporting',
+    'ylhtnom': 'monthly',
+    'yliaD': 'Daily',
+    'lawardhtiw': 'withdrawal',
+    'ylrae': 'early',
+    'enirU': 'Urine',
+    'ecnO': 'Once',
+    'reviL': 'Liver',
+    'weiveR': 'Review',
+    'lacisyhP': 'Physical',
+    'thgieW': 'Weight',
+    'thgieH': 'Height',
+    'sutats': 'status',
+    'nacs': 'scan',
+    'sisongaid': 'diagnosis',
+    'eugolana': 'analogue',
+    'nitatsotamos': 'somatostatin',
+    'smotpmys': 'symptoms',
+    'tnemtaert': 'treatment',
+    'sesylana': 'analyses',
+    'eerf': 'free',
+    'lleC': 'Cell',
+    'elpmas': 'sample',
+    'doolb': 'blood',
+    'gniliforp': 'profiling',
+    'cimoneg': 'genomic',
+    'eliforp': 'profile',
+    'ruoh': 'hour',
+    'ninargomorhC': 'Chromogranin',
+    'ninikorueN': 'Neurokinin',
+    'seriannoitseuQ': 'Questionnaires',
+    'tcejbuS': 'Subject',
+    'noitartsinimdA': 'Administration',
+    'noitacidem': 'medication',
+    'tnatimocnoC': 'Concomitant',
+    'lacigrus': 'surgical',
+    'seipareht': 'therapies',
+    'serudecorp': 'procedures',
+    'gurd': 'drug',
+    'tnevE': 'Event',
+    'esrevdA': 'Adverse',
+    'noitelpmoC': 'Completion'
+}
+
+# Escaped alternation over the reversed words, built once and shared by
+# every pattern that embeds it
+_REV_ALT = '|'.join(re.escape(reversed_word) for reversed_word in reversed_patterns)
+
+# Single alternation matching every reversed word in one linear scan,
+# with a case-normalized lookup for the IGNORECASE matches. First entry
+# wins on keys that collide when lowercased ('gnineercS'/'gnineercs'),
+# matching the order the per-word passes used to apply them in
+_REVERSED_LOWER = {}
+for _reversed_word, _correct_word in reversed_patterns.items():
+    _REVERSED_LOWER.setdefault(_reversed_word.lower(), _correct_word)
+_REVERSED_RE = re.compile(r'\b(?:' + _REV_ALT + r')\b', re.IGNORECASE)
+
+# Optional Aho-Corasick automaton: matches all reversed words in one
+# C-level scan. Built lazily from the lowercase lookup so matching stays
+# case-insensitive; None when pyahocorasick isn't installed, in which
+# case the regex alternation is used instead.
+try:
+    import ahocorasick
+    _REVERSED_AUTOMATON = ahocorasick.Automaton()
+    for _word, _fixed in _REVERSED_LOWER.items():
+        _REVERSED_AUTOMATON.add_word(_word, (len(_word), _fixed))
+    _REVERSED_AUTOMATON.make_automaton()
+except ImportError:
+    _REVERSED_AUTOMATON = None
+
+def _is_word_char(ch):
+    return ch.isalnum() or ch == '_'
+
 def fix_reversed_text(text):
     """Fix reversed/mirrored text that sometimes appears in PDFs"""
-    import re
-    
-    # Common reversed words patterns
-    reversed_patterns = {
-        'tuohsaW': 'Washout',
-        'doireP': 'Period', 
-        'skeew': 'weeks',
-        'gnineercS': 'Screening',
-        'tisiV': 'Visit',
-        'gniwollof': 'following',
-        'gnineercs': 'screening',
-        'tnesnoC': 'Consent',
-        'demrofnI': 'Informed',
-        'gnitseT': 'Testing',
-        'ycnangerP': 'Pregnancy',
-        'kcehC': 'Check',
-        'airetirC': 'Criteria',
-        'ytilibigilE': 'Eligibility',
-        'tneitap': 'patient',
-        'syaD': 'Days',
-        'motpmys': 'symptom',
-        'gnitroper': 'reporting',
-        'ylhtnom': 'monthly',
-        'yliaD': 'Daily',
-        'lawardhtiw': 'withdrawal',
-        'ylrae': 'early',
-        'enirU': 'Urine',
-        'ecnO': 'Once',
-        'reviL': 'Liver',
-        'weiveR': 'Review',
-        'lacisyhP': 'Physical',
-        'thgieW': 'Weight',
-        'thgieH': 'Height',
-        'sutats': 'status',
-        'nacs': 'scan',
-        'sisongaid': 'diagnosis',
-        'eugolana': 'analogue',
-        'nitatsotamos': 'somatostatin',
-        'smotpmys': 'symptoms',
-        'tnemtaert': 'treatment',
-        'sesylana': 'analyses',
-        'eerf': 'free',
-        'lleC': 'Cell',
-        'elpmas': 'sample',
-        'doolb': 'blood',
-        'gniliforp': 'profiling',
-        'cimoneg': 'genomic',
-        'eliforp': 'profile',
-        'ruoh': 'hour',
-        'ninargomorhC': 'Chromogranin',
-        'ninikorueN': 'Neurokinin',
-        'seriannoitseuQ': 'Questionnaires',
-        'tcejbuS': 'Subject',
-        'noitartsinimdA': 'Administration',
-        'noitacidem': 'medication',
-        'tnatimocnoC': 'Concomitant',
-        'lacigrus': 'surgical',
-        'seipareht': 'therapies',
-        'serudecorp': 'procedures',
-        'gurd': 'drug',
-        'tnevE': 'Event',
-        'esrevdA': 'Adverse',
-        'noitelpmoC': 'Completion'
-    }
-    
-    # Replace reversed patterns
-    for reversed_word, correct_word in reversed_patterns.items():
-        text = re.sub(r'\b' + re.escape(reversed_word) + r'\b', correct_word, text, flags=re.IGNORECASE)
-    
-    return text
+    # One probing scan of the alternation; clean text bails out here
+    # without paying for the replacement machinery
+    if not _REVERSED_RE.search(text):
+        return text
+    lowered = text.lower()
+    # The automaton walks the lowered copy, so its offsets only map back
+    # onto text when lowercasing preserved the length ('İ'.lower() is two
+    # characters); fall back to the regex pass when it didn't
+    if _REVERSED_AUTOMATON is None or len(lowered) != len(text):
+        # Replace all reversed patterns in a single regex pass. IGNORECASE
+        # matches by case-folding, which .lower() doesn't always mirror
+        # (e.g. 'ſ' folds to 's' but lowercases to itself), so fall back
+        # to the match itself rather than raising on such inputs
+        return _REVERSED_RE.sub(
+            lambda m: _REVERSED_LOWER.get(m.group(0).lower(), m.group(0)), text
+        )
+
+    parts = []
+    last = 0
+    n = len(text)
+    for end, (length, fixed) in _REVERSED_AUTOMATON.iter(lowered):
+        start = end - length + 1
+        if start < last:
+            continue  # overlaps a replacement already emitted
+        # Word-boundary guard equivalent to the regex \b anchors
+        if (start > 0 and _is_word_char(text[start - 1])) or \
+           (end + 1 < n and _is_word_char(text[end + 1])):
+            continue
+        parts.append(text[last:start])
+        parts.append(fixed)
+        last = end + 1
+    parts.append(text[last:])
+    return "".join(parts)
+
+# Common CID code to character mappings, keyed by the numeric code so a
+# single regex pass can decode the whole text
+_CID_INT_MAP = {
+    3: ' ',      # space
+    20: '1',     # number 1
+    21: '2',     # number 2
+    22: '3',     # number 3
+    23: '4',     # number 4
+    24: '5',     # number 5
+    25: '6',     # number 6
+    26: '7',     # number 7
+    27: '8',     # number 8
+    28: '9',     # number 9
+    19: '0',     # number 0
+    36: 'A',     # letter A
+    37: 'B',     # letter B
+    38: 'C',     # letter C
+    39: 'D',     # letter D
+    40: 'E',     # letter E
+    41: 'F',     # letter F
+    42: 'G',     # letter G
+    43: 'H',     # letter H
+    44: 'I',     # letter I
+    45: 'J',     # letter J
+    46: 'K',     # letter K
+    47: 'L',     # letter L
+    48: 'M',     # letter M
+    49: 'N',     # letter N
+    50: 'O',     # letter O
+    51: 'P',     # letter P
+    52: 'Q',     # letter Q
+    53: 'R',     # letter R
+    54: 'S',     # letter S
+    55: 'T',     # letter T
+    56: 'U',     # letter U
+    57: 'V',     # letter V
+    58: 'W',     # letter W
+    59: 'X',     # letter X
+    60: 'Y',     # letter Y
+    61: 'Z',     # letter Z
+    68: 'a',     # letter a
+    69: 'b',     # letter b
+    70: 'c',     # letter c
+    71: 'd',     # letter d
+    72: 'e',     # letter e
+    73: 'f',     # letter f
+    74: 'g',     # letter g
+    75: 'h',     # letter h
+    76: 'i',     # letter i
+    77: 'j',     # letter j
+    78: 'k',     # letter k
+    79: 'l',     # letter l
+    80: 'm',     # letter m
+    81: 'n',     # letter n
+    82: 'o',     # letter o
+    83: 'p',     # letter p
+    84: 'q',     # letter q
+    85: 'r',     # letter r
+    86: 's',     # letter s
+    87: 't',     # letter t
+    88: 'u',     # letter u
+    89: 'v',     # letter v
+    90: 'w',     # letter w
+    91: 'x',     # letter x
+    92: 'y',     # letter y
+    93: 'z',     # letter z
+    177: '-',    # dash
+    18: '/',     # slash
+    17: '.',     # period/full stop
+    29: ':',     # colon
+    15: ',',     # comma
+    11: '(',     # opening parenthesis
+    12: ')',     # closing parenthesis
+    138: '®',    # registered trademark
+    16: '-',     # hyphen/dash
+    14: '.',     # period (alternative)
+    13: ' ',     # space (alternative)
+    59: ';',     # semicolon
+    33: '!',     # exclamation mark
+    63: '?',     # question mark
+    182: "'",    # apostrophe
+    147: '±',    # plus-minus sign
+    30: ';',     # semicolon
+    120: '•',    # bullet point
+    8: '%',      # percent sign
+    31: '≤',     # less than or equal to
+    32: ' ',     # space (common)
+    9: '\t',     # tab
+    179: '"',    # opening quote
+    180: '"',    # closing quote
+    119: 'ï',    # i with diaeresis (naïve)
+    181: 'μ',    # micro sign
+    34: '?',     # question mark
+    66: '_',     # underscore
+}
+
+_CID_RE = re.compile(r'\(cid:(\d+)\)')
 
 def decode_cid_codes(text):
     """Decode common CID codes to readable text"""
-    # Common CID to character mappings
-    cid_mappings = {
-        '(cid:3)': ' ',      # space
-        '(cid:20)': '1',     # number 1
-        '(cid:21)': '2',     # number 2
-        '(cid:22)': '3',     # number 3
-        '(cid:23)': '4',     # number 4
-        '(cid:24)': '5',     # number 5
-        '(cid:25)': '6',     # number 6
-        '(cid:26)': '7',     # number 7
-        '(cid:27)': '8',     # number 8
-        '(cid:28)': '9',     # number 9
-        '(cid:19)': '0',     # number 0
-        '(cid:36)': 'A',     # letter A
-        '(cid:37)': 'B',     # letter B
-        '(cid:38)': 'C',     # letter C
-        '(cid:39)': 'D',     # letter D
-        '(cid:40)': 'E',     # letter E
-        '(cid:41)': 'F',     # letter F
-        '(cid:42)': 'G',     # letter G
-        '(cid:43)': 'H',     # letter H
-        '(cid:44)': 'I',     # letter I
-        '(cid:45)': 'J',     # letter J
-        '(cid:46)': 'K',     # letter K
-        '(cid:47)': 'L',     # letter L
-        '(cid:48)': 'M',     # letter M
-        '(cid:49)': 'N',     # letter N
-        '(cid:50)': 'O',     # letter O
-        '(cid:51)': 'P',     # letter P
-        '(cid:52)': 'Q',     # letter Q
-        '(cid:53)': 'R',     # letter R
-        '(cid:54)': 'S',     # letter S
-        '(cid:55)': 'T',     # letter T
-        '(cid:56)': 'U',     # letter U
-        '(cid:57)': 'V',     # letter V
-        '(cid:58)': 'W',     # letter W
-        '(cid:59)': 'X',     # letter X
-        '(cid:60)': 'Y',     # letter Y
-        '(cid:61)': 'Z',     # letter Z
-        '(cid:68)': 'a',     # letter a
-        '(cid:69)': 'b',     # letter b
-        '(cid:70)': 'c',     # letter c
-        '(cid:71)': 'd',     # letter d
-        '(cid:72)': 'e',     # letter e
-        '(cid:73)': 'f',     # letter f
-        '(cid:74)': 'g',     # letter g
-        '(cid:75)': 'h',     # letter h
-        '(cid:76)': 'i',     # letter i
-        '(cid:77)': 'j',     # letter j
-        '(cid:78)': 'k',     # letter k
-        '(cid:79)': 'l',     # letter l
-        '(cid:80)': 'm',     # letter m
-        '(cid:81)': 'n',     # letter n
-        '(cid:82)': 'o',     # letter o
-        '(cid:83)': 'p',     # letter p
-        '(cid:84)': 'q',     # letter q
-        '(cid:85)': 'r',     # letter r
-        '(cid:86)': 's',     # letter s
-        '(cid:87)': 't',     # letter t
-        '(cid:88)': 'u',     # letter u
-        '(cid:89)': 'v',     # letter v
-        '(cid:90)': 'w',     # letter w
-        '(cid:91)': 'x',     # letter x
-        '(cid:92)': 'y',     # letter y
-        '(cid:93)': 'z',     # letter z
-        '(cid:177)': '-',    # dash
-        '(cid:18)': '/',     # slash
-        '(cid:17)': '.',     # period/full stop
-        '(cid:29)': ':',     # colon
-        '(cid:15)': ',',     # comma
-        '(cid:11)': '(',     # opening parenthesis
-        '(cid:12)': ')',     # closing parenthesis
-        '(cid:138)': '®',    # registered trademark
-        '(cid:16)': '-',     # hyphen/dash
-        '(cid:14)': '.',     # period (alternative)
-        '(cid:13)': ' ',     # space (alternative)
-        '(cid:59)': ';',     # semicolon
-        '(cid:33)': '!',     # exclamation mark
-        '(cid:63)': '?',     # question mark
-        '(cid:182)': "'",    # apostrophe
-        '(cid:147)': '±',    # plus-minus sign
-        '(cid:30)': ';',     # semicolon
-        '(cid:120)': '•',    # bullet point
-        '(cid:8)': '%',      # percent sign
-        '(cid:31)': '≤',     # less than or equal to
-        '(cid:32)': ' ',     # space (common)
-        '(cid:9)': '\t',     # tab
-        '(cid:179)': '"',    # opening quote
-        '(cid:180)': '"',    # closing quote
-        '(cid:119)': 'ï',    # i with diaeresis (naïve)
-        '(cid:181)': 'μ',    # micro sign
-        '(cid:34)': '?',     # question mark
-        '(cid:66)': '_',     # underscore
-    }
-    
-    # Replace CID codes with actual characters
-    for cid, char in cid_mappings.items():
-        text = text.replace(cid, char)
-    
-    return text
+    if '(cid:' not in text:
+        return text
+    # Replace known CID codes in one scan; unknown codes are left intact so
+    # the downstream warning counter still sees them
+    return _CID_RE.sub(lambda m: _CID_INT_MAP.get(int(m.group(1)), m.group(0)), text)
+
+# Fused cleaning pass: CID decoding and reversed-word fixing each rewrote
+# the full text; a combined alternation does both in one scan so memory
+# traffic stays close to 1x the text size
+_CID_OR_REVERSED_RE = re.compile(
+    r'\(cid:(\d+)\)|\b(' + _REV_ALT + r')\b',
+    re.IGNORECASE
+)
+
+# A Cython/Numba-compiled cleaner was considered for this hot path, but
+# the app ships as a plain Streamlit script with no build step and no
+# compiler toolchain at deploy time. The cleaning passes already keep the
+# scanning inside C (the pyahocorasick automaton when installed, this
+# fused alternation otherwise); only the per-match replacement callback
+# runs in Python.
+def _cid_or_reversed_repl(m):
+    cid = m.group(1)
+    if cid is not None:
+        return _CID_INT_MAP.get(int(cid), m.group(0))
+    # .get with the match as fallback: IGNORECASE case-folds while the
+    # lookup key is .lower()ed, and the two disagree for e.g. 'ſ'
+    return _REVERSED_LOWER.get(m.group(2).lower(), m.group(2))
+
+def clean_extracted_text(text):
+    """Runs the full cleaning pipeline (CID codes, reversed words, PDF
+    artifacts) over the text in as few full-string passes as possible."""
+    if _REVERSED_AUTOMATON is not None:
+        # With pyahocorasick installed, the automaton beats the fused
+        # alternation on the reversed words; CIDs decode in their own pass
+        text = decode_cid_codes(text)
+        text = fix_reversed_text(text)
+    elif '(cid:' in text or _REVERSED_RE.search(text):
+        text = _CID_OR_REVERSED_RE.sub(_cid_or_reversed_repl, text)
+    return clean_pdf_artifacts(text)
+
+# Per-page extraction methods in default preference order
+_PDF_EXTRACT_METHODS = ('extract_text', 'extract_words', 'chars')
+
+def _extract_with_method(page, method):
+    """Runs one pdfplumber extraction method on a page, returning its text."""
+    if method == 'extract_text':
+        # Looser clustering tolerances give equivalent text for typical
+        # protocol PDFs while skipping much of pdfminer's conservative
+        # char-grouping work; revisit if layouts come out garbled
+        return page.extract_text(x_tolerance=2, y_tolerance=2, keep_blank_chars=False) or ""
+    if method == 'extract_words':
+        words = page.extract_words()
+        return " ".join([word['text'] for word in words]) if words else ""
+    chars = page.chars
+    return "".join([char['text'] for char in chars]) if chars else ""
+
+def _sniff_extract_method(page):
+    """Probes one page with all three methods and picks the best one.
+
+    Scores by the amount of real text (stripped length, discounting the
+    ~8 chars each undecoded CID code occupies) so the rest of the
+    document can use a single method instead of probing every page.
+    """
+    best_method, best_score = _PDF_EXTRACT_METHODS[0], -1
+    for method in _PDF_EXTRACT_METHODS:
+        try:
+            text = _extract_with_method(page, method)
+        except Exception:
+            continue
+        score = len(text.strip()) - 7 * len(_CID_RE.findall(text))
+        if score > best_score:
+            best_method, best_score = method, score
+    return best_method
+
+def _extract_page_text(file_bytes, page_num, method=_PDF_EXTRACT_METHODS[0]):
+    """Extracts text from a single page of the PDF in file_bytes.
+
+    Opens its own document: pdfplumber/pdfminer documents funnel every
+    page through one shared parser, file handle and object cache, none of
+    which are thread-safe, so worker threads must not share an open
+    document. Tries the sniffed method first and falls back to the others
+    only when it comes back empty. Runs inside a worker thread, so it
+    must not touch Streamlit APIs; debug output is returned for the
+    caller to display. Returns (page_num, text, kind, debug_lines) where
+    kind is one of 'text', 'table', 'empty' or 'error'.
+    """
+    import pdfplumber
+    debug_lines = []
+    try:
+        with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
+            page = pdf.pages[page_num - 1]
+            page_text = ""
+            fallbacks = (method,) + tuple(m for m in _PDF_EXTRACT_METHODS if m != method)
+            for candidate in fallbacks:
+                try:
+                    page_text = _extract_with_method(page, candidate)
+                    if page_text:
+                        debug_lines.append(f"  {candidate}: {len(page_text)} chars")
+                        break
+                except Exception as e:
+                    debug_lines.append(f"  {candidate} failed: {e}")
+
+            # Don't pre-clean CID codes here - let our decoder handle them
+            # Process ALL pages that have any text content (including CID codes)
+            if page_text:  # Any text at all, even just whitespace or CID codes
+                header = f"\n--- Page {page_num} (Raw: {len(page_text)} chars, Clean: {len(page_text.strip())} chars) ---\n"
+                return page_num, header + page_text, 'text', debug_lines
+
+            # If truly no text, try table extraction
+            tables = page.extract_tables()
+            if tables:
+                # Generators feed the joins directly, skipping the per-row and
+                # per-cell intermediate lists
+                table_text = "\n".join(
+                    " ".join(cell or "" for cell in row)
+                    for table in tables
+                    for row in table
+                    if row
+                )
+                if table_text:
+                    return (page_num,
+                            f"\n--- Page {page_num} (Table Data) ---\n" + table_text,
+                            'table', debug_lines)
+            return page_num, "", 'empty', debug_lines
+
+    except Exception as page_error:
+        debug_lines.append(f"Error processing page {page_num}: {page_error}")
+        return page_num, "", 'error', debug_lines
+
+# Below this page count a process pool costs more to start than it saves
+_PROCESS_POOL_MIN_PAGES = 16
+
+def _pdfium_extract_page(args):
+    """Process-pool worker: extracts one page's text from the PDF at path.
+
+    Opens its own document handle, since PDFium objects can't cross
+    process boundaries.
+    """
+    path, index = args
+    import pypdfium2 as pdfium
+    pdf = pdfium.PdfDocument(path)
+    try:
+        return pdf[index].get_textpage().get_text_range()
+    finally:
+        pdf.close()
+
+def _pdfium_extract_document(file_bytes):
+    """Extracts all text from a PDF with pypdfium2.
+
+    Pages share no mutable state, so long documents fan out to a process
+    pool, each worker reading from a temp copy of the file; short
+    documents stay in-process.
+    """
+    import pypdfium2 as pdfium
+    pdf = pdfium.PdfDocument(file_bytes)
+    try:
+        n_pages = len(pdf)
+        if n_pages < _PROCESS_POOL_MIN_PAGES or (os.cpu_count() or 1) < 2:
+            return "\n".join(page.get_textpage().get_text_range() for page in pdf)
+    finally:
+        pdf.close()
+
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        tmp.write(file_bytes)
+        path = tmp.name
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            texts = list(executor.map(_pdfium_extract_page,
+                                      [(path, i) for i in range(n_pages)]))
+        return "\n".join(texts)
+    except Exception:
+        # If the pool can't start (restricted environments), extract
+        # sequentially in-process instead
+        pdf = pdfium.PdfDocument(file_bytes)
+        try:
+            return "\n".join(page.get_textpage().get_text_range() for page in pdf)
+        finally:
+            pdf.close()
+    finally:
+        os.unlink(path)
+
+# A first-page probe must yield at least this many real (non-CID) chars
+# for PyPDF2 to be trusted with the whole document
+_PYPDF2_PROBE_MIN_CHARS = 200
+
+def _probe_pdf_backend(uploaded_file):
+    """Picks a PDF backend ('pypdf2' or 'pdfplumber') from a one-page probe.
+
+    Reads just the first page with PyPDF2; if it yields enough real text,
+    PyPDF2 handles the whole document, otherwise fall back to pdfplumber.
+    Avoids the old flow of probing five pages with PyPDF2 and then
+    re-parsing the entire file with pdfplumber anyway.
+    """
+    try:
+        import PyPDF2
+        uploaded_file.seek(0)
+        pdf_reader = PyPDF2.PdfReader(uploaded_file)
+        if pdf_reader.pages:
+            first_page_text = pdf_reader.pages[0].extract_text() or ""
+            if len(_CID_RE.sub('', first_page_text).strip()) > _PYPDF2_PROBE_MIN_CHARS:
+                return 'pypdf2'
+    except ImportError:
+        pass
+    except Exception:
+        pass
+    return 'pdfplumber'
 
 def extract_text_from_file(uploaded_file):
     """Extracts text from uploaded .txt, .md, or .pdf files."""
     if uploaded_file.name.lower().endswith('.pdf'):
-        # Try alternative PDF library first
-        st.write("🔄 Trying alternative PDF extraction method...")
+        # pypdfium2 (PDFium C++ bindings) extracts text in native code,
+        # typically several times faster than the pdfminer-based backends;
+        # prefer it and fall back below when it's missing or yields nothing
         try:
-            import PyPDF2
-            uploaded_file.seek(0)  # Reset file pointer
-            pdf_reader = PyPDF2.PdfReader(uploaded_file)
-            alt_text_parts = []
-            
-            st.write(f"PyPDF2 found {len(pdf_reader.pages)} pages")
-            for i, page in enumerate(pdf_reader.pages[:5]):  # Test first 5 pages
-                try:
-                    page_text = page.extract_text()
-                    st.write(f"PyPDF2 Page {i+1}: {len(page_text)} chars")
-                    if page_text.strip():
-                        alt_text_parts.append(f"\n--- Page {i+1} (PyPDF2) ---\n")
-                        alt_text_parts.append(page_text)
-                except Exception as e:
-                    st.write(f"PyPDF2 Page {i+1} failed: {e}")
-            
-            if alt_text_parts:
-                st.success("✅ PyPDF2 extracted text successfully!")
-                return "\n".join(alt_text_parts)
-            else:
-                st.warning("⚠️ PyPDF2 also failed, trying pdfplumber...")
+            import pypdfium2
+            pdfium_text = _pdfium_extract_document(uploaded_file.getvalue())
+            if pdfium_text.strip():
+                return clean_extracted_text(pdfium_text)
         except ImportError:
-            st.write("PyPDF2 not available, using pdfplumber...")
+            pass
         except Exception as e:
-            st.write(f"PyPDF2 extraction failed: {e}")
-        
+            st.write(f"pypdfium2 extraction failed: {e}")
+
+        # Choose the backend once per file (cached across reruns) instead
+        # of always trying PyPDF2 first and re-parsing with pdfplumber
+        backend_cache = st.session_state.setdefault("pdf_backend", {})
+        file_hash = hashlib.md5(uploaded_file.getvalue()).hexdigest()
+        backend = backend_cache.get(file_hash)
+        if backend is None:
+            backend = _probe_pdf_backend(uploaded_file)
+            backend_cache[file_hash] = backend
+
+        if backend == 'pypdf2':
+            try:
+                import PyPDF2
+                uploaded_file.seek(0)  # Reset file pointer
+                pdf_reader = PyPDF2.PdfReader(uploaded_file)
+                alt_text_parts = []
+                alt_debug = [f"PyPDF2 found {len(pdf_reader.pages)} pages"]
+
+                for i, page in enumerate(pdf_reader.pages):
+                    try:
+                        page_text = page.extract_text()
+                        alt_debug.append(f"PyPDF2 Page {i+1}: {len(page_text)} chars")
+                        if page_text.strip():
+                            alt_text_parts.append(f"\n--- Page {i+1} (PyPDF2) ---\n")
+                            alt_text_parts.append(page_text)
+                    except Exception as e:
+                        alt_debug.append(f"PyPDF2 Page {i+1} failed: {e}")
+
+                if alt_text_parts:
+                    st.success("✅ PyPDF2 extracted text successfully!")
+                    with st.expander("Extraction debug"):
+                        st.code("\n".join(alt_debug))
+                    return "\n".join(alt_text_parts)
+                else:
+                    st.warning("⚠️ PyPDF2 also failed, trying pdfplumber...")
+                    backend_cache[file_hash] = 'pdfplumber'
+            except Exception as e:
+                st.write(f"PyPDF2 extraction failed: {e}")
+                backend_cache[file_hash] = 'pdfplumber'
+
         # Reset file pointer for pdfplumber
         uploaded_file.seek(0)
         try:
+            import pdfplumber
             with pdfplumber.open(uploaded_file) as pdf:
-                text_parts = []
+                text_buf = io.StringIO()
                 total_pages = len(pdf.pages)
                 processed_pages = 0
                 
-                # Debug info
                 st.info(f"📄 Found {total_pages} pages in PDF. Starting extraction...")
-                st.write(f"PDF object type: {type(pdf)}")
-                st.write(f"Pages list length: {len(pdf.pages)}")
-                
-                # Add progress bar for large PDFs
+
+                # Add progress bar for large PDFs; update it at most ~100
+                # times so the frontend isn't re-rendered per page
                 if total_pages > 10:
                     progress_bar = st.progress(0)
                     status_text = st.empty()
+                    progress_step = max(1, total_pages // 100)
                 
                 empty_pages = 0
                 error_pages = 0
-                
-                # Try to access each page first to see if there are issues
-                st.write("Checking page accessibility...")
-                for i, page in enumerate(pdf.pages[:5]):  # Check first 5 pages
-                    try:
-                        page_obj = pdf.pages[i]
-                        st.write(f"Page {i+1}: {type(page_obj)} - OK")
-                    except Exception as e:
-                        st.error(f"Page {i+1}: Error accessing - {e}")
-                
-                st.write("Starting page-by-page extraction...")
-                
-                for page_num, page in enumerate(pdf.pages, 1):
-                    st.write(f"Attempting to process page {page_num}...")
-                    try:
-                        # Update progress for large PDFs
-                        if total_pages > 10:
-                            progress = page_num / total_pages
-                            progress_bar.progress(progress)
-                            status_text.text(f"Processing page {page_num}/{total_pages}")
-                        
-                        # Try multiple extraction methods
-                        page_text = ""
-                        
-                        # Method 1: Standard extraction
-                        try:
-                            page_text = page.extract_text() or ""
-                            st.write(f"  Method 1 (extract_text): {len(page_text)} chars")
-                        except Exception as e:
-                            st.write(f"  Method 1 failed: {e}")
-                        
-                        # Method 2: Alternative extraction if Method 1 fails or is empty
-                        if not page_text:
-                            try:
-                                # Try extracting words and joining them
-                                words = page.extract_words()
-                                if words:
-                                    page_text = " ".join([word['text'] for word in words])
-                                    st.write(f"  Method 2 (extract_words): {len(page_text)} chars")
-                            except Exception as e:
-                                st.write(f"  Method 2 failed: {e}")
-                        
-                        # Method 3: Character-level extraction if others fail
-                        if not page_text:
-                            try:
-                                chars = page.chars
-                                if chars:
-                                    page_text = "".join([char['text'] for char in chars])
-                                    st.write(f"  Method 3 (chars): {len(page_text)} chars")
-                            except Exception as e:
-                                st.write(f"  Method 3 failed: {e}")
-                        
-                        # Don't pre-clean CID codes here - let our decoder handle them
-                        original_text = page_text
-                        
-                        # Debug: Check what we got from this page
-                        text_length = len(original_text)
-                        stripped_length = len(original_text.strip())
-                        
-                        # Show debug info for first few pages
-                        if page_num <= 5:
-                            st.write(f"Debug Page {page_num}: Raw length={text_length}, Stripped length={stripped_length}")
-                            if text_length > 0:
-                                preview = original_text[:100].replace('\n', '\\n')
-                                st.write(f"Preview: {preview}...")
-                        
-                        # Process ALL pages that have any text content (including CID codes)
-                        if original_text:  # Any text at all, even just whitespace or CID codes
-                            text_parts.append(f"\n--- Page {page_num} (Raw: {text_length} chars, Clean: {stripped_length} chars) ---\n")
-                            text_parts.append(original_text)
-                            processed_pages += 1
-                        
-                        # If truly no text, try table extraction
-                        else:
-                            tables = page.extract_tables()
-                            if tables:
-                                text_parts.append(f"\n--- Page {page_num} (Table Data) ---\n")
-                                table_text = []
-                                for table in tables:
-                                    for row in table:
-                                        if row:
-                                            table_text.append(" ".join([cell or "" for cell in row]))
-                                if table_text:
-                                    text_parts.extend(table_text)
-                                    processed_pages += 1
-                                else:
-                                    empty_pages += 1
-                            else:
-                                empty_pages += 1
-                        
-                        # Limit processing for extremely large PDFs to prevent memory issues
-                        if len(text_parts) > 1000:  # Roughly 50+ pages of content
-                            st.warning(f"⚠️ Large PDF detected. Processing first {processed_pages} pages to avoid memory issues.")
+
+                # Sniff the best extraction method once on the first page
+                # rather than probing all three methods on every page
+                extract_method = _sniff_extract_method(pdf.pages[0]) if pdf.pages else _PDF_EXTRACT_METHODS[0]
+
+                # Pages are independent and pdfminer releases the GIL in its
+                # hot paths, so extract them in parallel and reassemble in
+                # page order afterwards. Each worker opens its own document
+                # from the raw bytes; pdfplumber documents are not safe to
+                # share across threads
+                file_bytes = uploaded_file.getvalue()
+                results = []
+                done = 0
+                extracted_chars = 0
+                with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=min(8, os.cpu_count() or 1)
+                ) as executor:
+                    futures = [
+                        executor.submit(_extract_page_text, file_bytes, page_num, extract_method)
+                        for page_num in range(1, total_pages + 1)
+                    ]
+                    for future in concurrent.futures.as_completed(futures):
+                        result = future.result()
+                        results.append(result)
+                        done += 1
+                        extracted_chars += len(result[1])
+                        # Stop extracting once enough text is in hand so an
+                        # extremely large PDF doesn't hold every page in
+                        # memory before the output cap below applies
+                        if extracted_chars > 2_000_000:
+                            for pending in futures:
+                                pending.cancel()
                             break
-                            
-                    except Exception as page_error:
+                        if total_pages > 10 and (done % progress_step == 0 or done == total_pages):
+                            progress_bar.progress(done / total_pages)
+                            status_text.text(f"Processing page {done}/{total_pages}")
+
+                debug_lines = []
+                for page_num, page_text, kind, page_debug in sorted(results):
+                    if kind in ('text', 'table'):
+                        text_buf.write(page_text)
+                        text_buf.write("\n")
+                        processed_pages += 1
+                    elif kind == 'error':
                         error_pages += 1
-                        st.warning(f"⚠️ Error processing page {page_num}: {str(page_error)}")
-                        continue
-                
+                    else:
+                        empty_pages += 1
+                    if page_debug:
+                        debug_lines.append(f"Page {page_num} ({kind}):")
+                        debug_lines.extend(page_debug)
+
+                    # Limit processing for extremely large PDFs to prevent memory issues
+                    if text_buf.tell() > 2_000_000:  # Roughly 500+ pages of dense text
+                        st.warning(f"⚠️ Large PDF detected. Processing first {processed_pages} pages to avoid memory issues.")
+                        break
+
                 # Clean up progress indicators
                 if total_pages > 10:
                     progress_bar.empty()
                     status_text.empty()
-                
+
                 # Final status with breakdown
                 st.success(f"✅ Successfully processed {processed_pages} pages out of {total_pages}")
                 if empty_pages > 0:
                     st.info(f"📄 {empty_pages} pages were empty or contained no extractable text")
                 if error_pages > 0:
                     st.warning(f"⚠️ {error_pages} pages had processing errors")
-                
-                extracted_text = "\n".join(text_parts)
-                
-                # Import re for regex operations
-                import re
-                
-                # First decode CID codes
-                decoded_text = decode_cid_codes(extracted_text)
-                
-                # Then fix reversed text
-                fixed_text = fix_reversed_text(decoded_text)
-                
-                # Finally clean PDF artifacts
-                cleaned_text = clean_pdf_artifacts(fixed_text)
-                
+                if debug_lines:
+                    with st.expander("Extraction debug"):
+                        st.code("\n".join(debug_lines))
+
+                extracted_text = text_buf.getvalue()
+
+                # Decode CID codes, fix reversed text and clean PDF
+                # artifacts in one fused pass
+                cleaned_text = clean_extracted_text(extracted_text)
+
                 # Check processing results
                 original_cid_count = len(re.findall(r'\(cid:\d+\)', extracted_text))
                 remaining_cid_count = len(re.findall(r'\(cid:\d+\)', cleaned_text))
@@ -429,41 +700,408 @@ def extract_text_from_file(uploaded_file):
             st.error(f"PDF processing error: {e}")
             return ""
     else:
-        return uploaded_file.getvalue().decode("utf-8")
+        # Sniff the encoding from the head of the file (Windows-1252
+        # protocols are common enough that hard-coded UTF-8 used to crash),
+        # then stream-decode without a second full-size copy
+        uploaded_file.seek(0)
+        head = uploaded_file.read(4096)
+        uploaded_file.seek(0)
+        encoding = "utf-8"
+        if any(byte > 0x7f for byte in head):
+            try:
+                from charset_normalizer import from_bytes
+                best = from_bytes(head).best()
+                if best is not None and best.encoding:
+                    encoding = best.encoding
+            except ImportError:
+                pass
+        wrapper = io.TextIOWrapper(uploaded_file, encoding=encoding, errors="replace")
+        try:
+            return wrapper.read()
+        finally:
+            # Detach so closing the wrapper can't close the upload buffer,
+            # which Streamlit reuses across reruns
+            wrapper.detach()
+
+class _NamedBytesIO(io.BytesIO):
+    """BytesIO carrying a filename, matching the uploaded-file interface
+    (.name/.seek/.getvalue) that extract_text_from_file relies on."""
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _extract_cached(file_bytes: bytes, filename: str) -> str:
+    """Runs extract_text_from_file memoized on the raw file bytes.
+
+    Streamlit reruns the whole script on every widget interaction; caching
+    on the file contents means an uploaded PDF is parsed once per session
+    instead of on every rerun.
+    """
+    return extract_text_from_file(_NamedBytesIO(file_bytes, filename))
+
+GEMINI_MODEL_NAME = "gemini-2.0-flash"
+
+# Prompt slicing: the six summary fields live in specific sections, so an
+# oversized protocol is trimmed to the document head (title/sponsor/phase
+# usually sit there) plus windows around the relevant headings; LLM cost
+# and latency grow with input tokens
+_SECTION_HEADING_RE = re.compile(
+    r'\b(?:objectives?|eligibility|inclusion|exclusion|endpoints?|outcomes?|sponsor|phase)\b',
+    re.IGNORECASE
+)
+_SLICE_PREFIX_CHARS = 20000
+_SLICE_WINDOW_CHARS = 2000
+_MAX_PROMPT_CHARS = 120000
+
+def _slice_relevant_sections(protocol_text):
+    """Trims an oversized protocol down to the sections the summary needs.
+
+    Texts already under the prompt cap are returned unchanged. Windows
+    around heading hits are merged where they overlap, so dense heading
+    regions (a table of contents, say) aren't shipped several times over.
+    """
+    if len(protocol_text) <= _MAX_PROMPT_CHARS:
+        return protocol_text
+
+    intervals = [[0, _SLICE_PREFIX_CHARS]]
+    for match in _SECTION_HEADING_RE.finditer(protocol_text, _SLICE_PREFIX_CHARS):
+        intervals.append([max(0, match.start() - _SLICE_WINDOW_CHARS),
+                          match.end() + _SLICE_WINDOW_CHARS])
+
+    merged = []
+    for interval in sorted(intervals):
+        if merged and interval[0] <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], interval[1])
+        else:
+            merged.append(interval)
+
+    pieces = []
+    total = 0
+    for start, end in merged:
+        piece = protocol_text[start:end]
+        pieces.append(piece)
+        total += len(piece)
+        if total >= _MAX_PROMPT_CHARS:
+            break
+
+    # If the headings matched almost nothing beyond the prefix, the
+    # document likely names its sections unusually; ship the capped head
+    # rather than pretending the slices are representative
+    if total - _SLICE_PREFIX_CHARS < 2000:
+        return protocol_text[:_MAX_PROMPT_CHARS]
+    return "\n\n".join(pieces)[:_MAX_PROMPT_CHARS]
+
+# Semantic cache settings: protocols whose embeddings are at least this
+# similar are treated as the same document
+_SEMANTIC_SIM_THRESHOLD = 0.95
+_SEMANTIC_EMBED_CHARS = 10000
+
+_EMBEDDING_MODEL_NAME = "models/text-embedding-004"
+
+def _embed_protocol(protocol_text):
+    """Embeds the head of the protocol with the Gemini embeddings endpoint.
+
+    The embeddings API rides on the genai client that's already
+    configured, so no extra local model is needed. Returns a normalized
+    numpy vector, or None if embedding fails (the semantic cache is then
+    skipped for this call).
+    """
+    import numpy as np
+    try:
+        genai = _genai()
+        result = genai.embed_content(
+            model=_EMBEDDING_MODEL_NAME,
+            content=protocol_text[:_SEMANTIC_EMBED_CHARS],
+        )
+        vector = np.asarray(result["embedding"], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if not norm:
+            return None
+        return vector / norm
+    except Exception:
+        return None
+
+def _semantic_cache_lookup(protocol_text):
+    """Checks the session semantic cache for a near-duplicate protocol.
+
+    Returns (embedding, cached_summary); cached_summary is None on a miss
+    and embedding is None when the text couldn't be embedded.
+    """
+    query = _embed_protocol(protocol_text)
+    if query is None:
+        return None, None
+    import numpy as np
+    embeddings = st.session_state.get("semantic_cache_embeddings")
+    summaries = st.session_state.get("semantic_cache_summaries", [])
+    if embeddings is not None and summaries:
+        scores = embeddings @ query
+        best = int(np.argmax(scores))
+        if scores[best] >= _SEMANTIC_SIM_THRESHOLD:
+            return query, summaries[best]
+    return query, None
+
+def _semantic_cache_store(embedding, summary_data):
+    """Adds a freshly generated summary to the session semantic cache."""
+    if embedding is None:
+        return
+    import numpy as np
+    embeddings = st.session_state.get("semantic_cache_embeddings")
+    if embeddings is None:
+        st.session_state.semantic_cache_embeddings = embedding[np.newaxis, :]
+        st.session_state.semantic_cache_summaries = [summary_data]
+    else:
+        st.session_state.semantic_cache_embeddings = np.vstack([embeddings, embedding])
+        st.session_state.semantic_cache_summaries.append(summary_data)
+
+@st.cache_resource(show_spinner=False)
+def _disk_cache():
+    """Opens the cross-session summary cache on disk.
+
+    Returns None when diskcache isn't installed; summaries are then only
+    cached in memory for the current session.
+    """
+    try:
+        import diskcache
+    except ImportError:
+        return None
+    return diskcache.Cache(os.path.expanduser("~/.trialsage_cache"))
+
+@st.cache_resource(show_spinner=False)
+def _model():
+    """Builds the configured GenerativeModel once per process.
+
+    Reconstructing it on every call re-parsed the system instruction and
+    redid client setup on each Streamlit rerun; the cached instance is
+    reused across requests and sessions.
+
+    Server-side context caching (genai.caching.CachedContent) was
+    considered for the system instruction, but the API only accepts
+    cached content of 32k+ tokens and this instruction is ~300, so the
+    create call would be rejected; client-side reuse here is all that
+    applies at this prompt size.
+    """
+    return _genai().GenerativeModel(
+        model_name=GEMINI_MODEL_NAME,
+        system_instruction=SYSTEM_INSTRUCTION,
+    )
+
+# Protocols above this size are sent via the Files API rather than inline
+_FILES_API_MIN_CHARS = 50000
+
+# The six keys every summary must carry, in display order
+_SUMMARY_FIELDS = ("officialTitle", "phase", "sponsor", "objective", "eligibility", "endpoints")
+_REQUIRED_KEYS = frozenset(_SUMMARY_FIELDS)
+_SUMMARY_DEFAULTS = {key: "Not specified" for key in _SUMMARY_FIELDS}
+
+# Compiled schema validator: catches type drift (e.g. phase coming back
+# as a list) that the key-presence check alone misses, in microseconds.
+# None when fastjsonschema isn't installed; the key check still applies.
+try:
+    import fastjsonschema
+    _validate_summary = fastjsonschema.compile({
+        "type": "object",
+        "required": list(_SUMMARY_FIELDS),
+        "properties": {key: {"type": "string"} for key in _SUMMARY_FIELDS},
+    })
+except ImportError:
+    _validate_summary = None
+
+def _fetch_missing_keys(protocol_text, missing):
+    """Asks the model for just the dropped keys.
+
+    A follow-up request for one or two fields is far cheaper than
+    regenerating the whole summary when the model omits something.
+    """
+    genai = _genai()
+    prompt = (
+        "From the clinical trial protocol below, return ONLY a JSON object "
+        f"with these keys: {', '.join(sorted(missing))}. "
+        'Use the string "Not specified" for anything the text does not state.'
+        "\n\n" + protocol_text
+    )
+    response = _model().generate_content(
+        prompt,
+        generation_config=genai.types.GenerationConfig(
+            response_mime_type="application/json",
+            temperature=0
+        ),
+    )
+    data = _json_loads(response.text)
+    return {key: value for key, value in data.items() if key in missing}
+
+@st.cache_data(show_spinner=False, max_entries=64, ttl=3600)
+def _cached_summary(text_hash: str, protocol_text: str):
+    """
+    Calls the Gemini API for a structured summary, cached by protocol hash.
+
+    The hash (protocol text + model name + system instruction) keys the
+    cache so re-summarizing identical text skips the API call entirely.
+    """
+    genai = _genai()
+    model = _model()
+
+    # Large protocols go through the Files API: the document uploads once
+    # and is referenced by handle, instead of serializing the whole string
+    # into the request protobuf and blocking on upload bandwidth per call
+    if len(protocol_text) > _FILES_API_MIN_CHARS:
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False,
+                                         encoding="utf-8") as tmp:
+            tmp.write(protocol_text)
+            tmp_path = tmp.name
+        try:
+            content = [genai.upload_file(tmp_path, mime_type="text/plain"),
+                       "Summarize the attached clinical trial protocol."]
+        finally:
+            os.unlink(tmp_path)
+    else:
+        content = protocol_text
+
+    # Stream the response so progress is visible while the model decodes,
+    # instead of blocking silently until the full JSON arrives
+    response = model.generate_content(
+        content,
+        generation_config=genai.types.GenerationConfig(
+            response_mime_type="application/json",
+            temperature=0
+        ),
+        stream=True
+    )
+
+    buf = []
+    placeholder = st.empty()
+    last_render = 0.0
+    for chunk in response:
+        if chunk.text:
+            buf.append(chunk.text)
+            # Rendering every chunk pushes a delta per token batch;
+            # a handful of updates per second reads the same
+            now = time.monotonic()
+            if now - last_render > 0.15:
+                placeholder.code("".join(buf)[-500:])
+                last_render = now
+    placeholder.empty()
+
+    summary_data = _json_loads("".join(buf))
+
+    # Validate that all required keys are in the response; if the model
+    # dropped some, re-prompt for just those instead of starting over
+    missing = _REQUIRED_KEYS - summary_data.keys()
+    if missing:
+        summary_data.update(_fetch_missing_keys(protocol_text, missing))
+        missing = _REQUIRED_KEYS - summary_data.keys()
+        if missing:
+            raise ValueError(
+                f"The AI response is missing required keys: {', '.join(sorted(missing))}"
+            )
+
+    if _validate_summary is not None:
+        _validate_summary(summary_data)
+
+    return summary_data
 
 def get_summary_from_gemini(protocol_text: str):
     """
     Calls the Gemini API to get a structured summary.
     Returns a dictionary with the summary or raises an exception on error.
     """
-    required_keys = ["officialTitle", "phase", "sponsor", "objective", "eligibility", "endpoints"]
-    
     try:
-        model = genai.GenerativeModel(
-            model_name="gemini-2.0-flash", # Using Gemini 2.0 Flash
-            system_instruction=SYSTEM_INSTRUCTION,
-        )
-        
-        response = model.generate_content(
-            protocol_text,
-            generation_config=genai.types.GenerationConfig(
-                response_mime_type="application/json",
-                temperature=0
-            )
-        )
-        
-        summary_data = json.loads(response.text)
-        
-        # Validate that all required keys are in the response
-        if not all(key in summary_data for key in required_keys):
-            raise ValueError("The AI response is missing one or more required keys.")
-            
+        # Ship only the relevant sections of oversized protocols; caching
+        # keys off the sliced text since that is what the model sees
+        protocol_text = _slice_relevant_sections(protocol_text)
+
+        text_hash = hashlib.sha256(
+            (protocol_text + GEMINI_MODEL_NAME + SYSTEM_INSTRUCTION).encode()
+        ).hexdigest()
+
+        # Exact-hash layers first: they are pure lookups, whereas the
+        # semantic cache pays an embedding API round-trip per query, so
+        # byte-identical re-submissions must never reach it
+        exact_cache = st.session_state.setdefault("summary_exact_cache", {})
+        cached = exact_cache.get(text_hash)
+        if cached is not None:
+            return cached
+
+        # The disk layer survives restarts, so a protocol summarized in an
+        # earlier session still skips the LLM round-trip
+        disk_cache = _disk_cache()
+        if disk_cache is not None:
+            cached = disk_cache.get(text_hash)
+            if cached is not None:
+                exact_cache[text_hash] = cached
+                # Seed the session semantic index so near-duplicates of a
+                # previously summarized protocol can hit it too
+                _semantic_cache_store(_embed_protocol(protocol_text), cached)
+                return cached
+
+        # Near-duplicate protocols (same content, different formatting)
+        # miss the exact hash; only they pay for an embedding
+        embedding, cached = _semantic_cache_lookup(protocol_text)
+        if cached is not None:
+            exact_cache[text_hash] = cached
+            return cached
+
+        summary_data = _cached_summary(text_hash, protocol_text)
+        if disk_cache is not None:
+            disk_cache.set(text_hash, summary_data)
+        _semantic_cache_store(embedding, summary_data)
+        exact_cache[text_hash] = summary_data
         return summary_data
 
     except Exception as e:
         st.error(f"An error occurred while generating the summary: {e}")
         return None
 
+def _prerender_markdown_sections(summary):
+    """Pre-renders the three markdown-formatted sections to HTML once.
+
+    Saves the markdown parse on every subsequent rerun. Returns None when
+    markdown2 isn't installed; the raw markdown is then handed to
+    st.markdown as before.
+    """
+    try:
+        import markdown2
+    except ImportError:
+        return None
+    return {
+        key: markdown2.markdown(summary.get(key, 'Not specified'))
+        for key in ('objective', 'eligibility', 'endpoints')
+    }
+
+def _format_plain_summary(summary):
+    """Builds the copyable plain-text block for a summary.
+
+    Called once when a summary arrives so reruns just reuse the stored
+    string instead of re-interpolating it.
+    """
+    return "\n".join([
+        "",
+        f"Official Title: {summary.get('officialTitle')}",
+        f"Phase: {summary.get('phase')}",
+        f"Sponsor: {summary.get('sponsor')}",
+        "",
+        "Objective:",
+        f"{summary.get('objective')}",
+        "",
+        "Eligibility Criteria:",
+        f"{summary.get('eligibility')}",
+        "",
+        "Endpoints:",
+        f"{summary.get('endpoints')}",
+        "",
+    ])
+
+def _run_summary_job(protocol_text, job):
+    """Background-thread target wrapping get_summary_from_gemini.
+
+    Writes into the shared job dict; the main script polls it between
+    reruns, so the UI stays responsive while the model works.
+    """
+    try:
+        job["result"] = get_summary_from_gemini(protocol_text)
+    finally:
+        job["done"] = True
+
 
 # --- Streamlit UI ---
 
@@ -490,17 +1128,20 @@ with left_col:
     uploaded_file = st.file_uploader(
         "Upload Protocol File",
         type=['txt', 'md', 'pdf'],
-        on_change=lambda: st.session_state.update(summary=None, error=None) # Clear old summary on new file
+        # Clear old summary on new file, and drop any in-flight job so its
+        # result isn't adopted as the new document's summary
+        on_change=lambda: st.session_state.update(
+            summary=None, error=None, loading=False, summary_job=None
+        )
     )
     
     # Add PDF to TXT conversion option
     if uploaded_file and uploaded_file.name.lower().endswith('.pdf'):
         if st.button("🔄 Convert PDF to TXT (for better processing)", use_container_width=True):
-            extracted_text = extract_text_from_file(uploaded_file)
-            
+            extracted_text = _extract_cached(uploaded_file.getvalue(), uploaded_file.name)
+
             # Check if text contains many CID codes
-            import re
-            cid_count = len(re.findall(r'\(cid:\d+\)', extracted_text))
+            cid_count = len(_CID_RE.findall(extracted_text))
             
             if cid_count > 10:
                 st.error("⚠️ This PDF contains unrecognizable character encoding. Suggestions:")
@@ -517,8 +1158,12 @@ with left_col:
                     mime="text/plain"
                 )
     
-    if uploaded_file:
-        st.session_state.protocol_text = extract_text_from_file(uploaded_file)
+    # Only extract when a new file arrives; otherwise every rerun (each
+    # keystroke in the text area) would overwrite the user's edits with
+    # freshly re-extracted text
+    if uploaded_file and st.session_state.get("_last_file_id") != uploaded_file.file_id:
+        st.session_state.protocol_text = _extract_cached(uploaded_file.getvalue(), uploaded_file.name)
+        st.session_state._last_file_id = uploaded_file.file_id
 
     st.session_state.protocol_text = st.text_area(
         "Protocol Text",
@@ -543,13 +1188,9 @@ with left_col:
     if text_issues:
         issue_text = " + ".join(text_issues)
         if st.button(f"🔧 Fix Text Issues ({issue_text})", use_container_width=True):
-            # First decode CID codes
-            processed_text = decode_cid_codes(st.session_state.protocol_text)
-            # Then fix reversed text
-            processed_text = fix_reversed_text(processed_text)
-            # Finally clean artifacts
-            processed_text = clean_pdf_artifacts(processed_text)
-            st.session_state.protocol_text = processed_text
+            # Decode CID codes, fix reversed text and clean artifacts in
+            # one fused pass
+            st.session_state.protocol_text = clean_extracted_text(st.session_state.protocol_text)
             st.success(f"✅ Fixed: {issue_text}")
             st.rerun()
 
@@ -562,27 +1203,57 @@ with left_col:
                 st.session_state.loading = True
                 st.session_state.summary = None
                 st.session_state.error = None
-                
+                # Discard any job left over from an interrupted run so its
+                # result can't be adopted as this text's summary
+                st.session_state.summary_job = None
+
     with col2:
         if st.button("Clear", use_container_width=True):
             st.session_state.protocol_text = ""
             st.session_state.summary = None
+            st.session_state.plain_text_summary = None
+            st.session_state.rendered_sections = None
             st.session_state.error = None
             st.session_state.loading = False
+            # Orphan any in-flight job; the thread finishes into its own
+            # dict and is never polled again
+            st.session_state.summary_job = None
 
-# Handle summary generation
+# Handle summary generation in a background thread so the script isn't
+# frozen inside the multi-second Gemini call; this block polls the job
+# and reruns until it completes, keeping the rest of the UI responsive
 if st.session_state.loading:
     with right_col:
-        with st.spinner('AI is analyzing the protocol...'):
-            summary_result = get_summary_from_gemini(st.session_state.protocol_text)
-            if summary_result:
-                st.session_state.summary = summary_result
+        job = st.session_state.get("summary_job")
+        if job is None:
+            job = {"done": False, "result": None}
+            st.session_state.summary_job = job
+            worker = threading.Thread(
+                target=_run_summary_job,
+                args=(st.session_state.protocol_text, job),
+                daemon=True,
+            )
+            # Hand the worker the script context so the cache and
+            # session-state layers keep working off the main thread
+            add_script_run_ctx(worker, get_script_run_ctx())
+            worker.start()
+
+        if job["done"]:
+            if job["result"]:
+                st.session_state.summary = job["result"]
+                st.session_state.plain_text_summary = _format_plain_summary(job["result"])
+                st.session_state.rendered_sections = _prerender_markdown_sections(job["result"])
             else:
                 # Error is handled and displayed within the get_summary_from_gemini function
                 # We just need to ensure we capture that an error occurred.
                 st.session_state.error = st.session_state.error or "Failed to generate summary. Check logs for details."
             st.session_state.loading = False
+            st.session_state.summary_job = None
             st.rerun() # Rerun to update the display
+        else:
+            with st.spinner('AI is analyzing the protocol...'):
+                time.sleep(0.5)
+            st.rerun()
 
 # --- Right Column (Output) ---
 with right_col:
@@ -596,40 +1267,46 @@ with right_col:
     
     if st.session_state.summary:
         summary = st.session_state.summary
-        
+
+        # Unpack every field in one pass instead of repeated .get calls
+        # with the same default on each rerun
+        title, phase, sponsor, objective, eligibility, endpoints = itemgetter(
+            *_SUMMARY_FIELDS
+        )({**_SUMMARY_DEFAULTS, **summary})
+
         # Display Study Details
         st.markdown("### Study Details")
-        st.markdown(f"**Official Title:** {summary.get('officialTitle', 'Not specified')}")
-        st.markdown(f"**Phase:** {summary.get('phase', 'Not specified')}")
-        st.markdown(f"**Sponsor:** {summary.get('sponsor', 'Not specified')}")
+        st.markdown(f"**Official Title:** {title}")
+        st.markdown(f"**Phase:** {phase}")
+        st.markdown(f"**Sponsor:** {sponsor}")
         st.divider()
 
-        # Display Formatted Sections
+        # Display Formatted Sections, preferring the HTML pre-rendered
+        # when the summary arrived over re-parsing the markdown each rerun
+        rendered = st.session_state.get("rendered_sections") or {}
         st.markdown("### Objective")
-        st.markdown(summary.get('objective', 'Not specified'), unsafe_allow_html=True)
+        st.markdown(rendered.get('objective', objective), unsafe_allow_html=True)
         st.divider()
 
         st.markdown("### Eligibility Criteria")
-        st.markdown(summary.get('eligibility', 'Not specified'), unsafe_allow_html=True)
+        st.markdown(rendered.get('eligibility', eligibility), unsafe_allow_html=True)
         st.divider()
 
         st.markdown("### Endpoints")
-        st.markdown(summary.get('endpoints', 'Not specified'), unsafe_allow_html=True)
+        st.markdown(rendered.get('endpoints', endpoints), unsafe_allow_html=True)
         
-        # Plain text for copy button
-        plain_text_summary = f"""
-Official Title: {summary.get('officialTitle')}
-Phase: {summary.get('phase')}
-Sponsor: {summary.get('sponsor')}
-
-Objective:
-{summary.get('objective')}
-
-Eligibility Criteria:
-{summary.get('eligibility')}
-
-Endpoints:
-{summary.get('endpoints')}
-"""
-        st.code(plain_text_summary, language='text')
-        st.markdown("*(The text above is formatted for easy copying.)*")
\ No newline at end of file
+        # Plain text for copying, precomputed when the summary arrived.
+        # A download button plus a collapsed text area replaces the old
+        # st.code block, whose syntax highlighter re-rendered the whole
+        # summary in the browser on every rerun
+        plain_text_summary = (st.session_state.get("plain_text_summary")
+                              or _format_plain_summary(summary))
+        st.download_button(
+            label="⬇️ Download summary as TXT",
+            data=plain_text_summary,
+            file_name="summary.txt",
+            mime="text/plain",
+        )
+        with st.expander("Plain-text summary (for copying)"):
+            st.text_area("Summary text", plain_text_summary, height=300,
+                         label_visibility="collapsed")
\ No newline at end of file